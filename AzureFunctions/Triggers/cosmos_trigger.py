@@ -1,25 +1,28 @@
 # Triggers/cosmos_trigger.py
-import os
 import uuid
 import logging
 import json
 from datetime import datetime
+from collections import Counter
 from typing import Iterable, Any, Dict
 
-from azure.cosmos import CosmosClient
+from shared.cosmos_singleton import COSMOS_CONN, INSIGHT_CONTAINER, insights_container
 
-# Initialize Cosmos DB client & Insight container (writes insights)
-COSMOS_CONN = os.getenv("COSMOSDB_CONN_STRING")
-COSMOS_DB = os.getenv("COSMOSDB_DB_NAME", "ProcessedLogs")
-INSIGHT_CONTAINER = os.getenv("COSMOSDB_INSIGHT_CONTAINER", "TriggerInsights")
+# orjson is much faster than stdlib json for the change-feed log dumps; fall back if missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+# Insight container (writes insights) comes from the shared process-wide Cosmos client
 if not COSMOS_CONN:
     logging.warning("COSMOSDB_CONN_STRING not set. Insight upserts will fail if attempted.")
 
-# create client lazily so module import doesn't fail if env missing
-_cosmos_client = CosmosClient.from_connection_string(COSMOS_CONN, connection_verify=False) if COSMOS_CONN else None
-_db = _cosmos_client.get_database_client(COSMOS_DB) if _cosmos_client else None
-_insight_container = _db.get_container_client(INSIGHT_CONTAINER) if _db else None
+
+def _json_dumps(obj) -> str:
+    if orjson:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str)
 
 
 def _doc_to_dict(d: Any) -> Dict[str, Any]:
@@ -69,29 +72,72 @@ def _doc_to_dict(d: Any) -> Dict[str, Any]:
     return {"_raw_repr": str(d)}
 
 
-def _flex_get(d: Any, keys, default=None):
-    """
-    Robust field extraction from a document of unknown type.
-    keys: iterable of possible field names (case-insensitive)
-    """
+def _json_doc(d: Any) -> Dict[str, Any]:
+    raw = d.to_json()
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def _pick_converter(d: Any):
+    """Choose the cheapest conversion that works for this doc's type (same order as _doc_to_dict)."""
+    if isinstance(d, dict):
+        return lambda x: x
+    try:
+        dict(d)
+        return dict
+    except Exception:
+        pass
+    if hasattr(d, "to_json"):
+        return _json_doc
+    return _doc_to_dict
+
+
+# doc type -> converter; the Functions host delivers one concrete type per batch,
+# so the type checks in _doc_to_dict run once per type instead of once per doc
+_CONVERTERS: Dict[type, Any] = {}
+
+
+def _convert(d: Any) -> Dict[str, Any]:
+    conv = _CONVERTERS.get(type(d))
+    if conv is None:
+        conv = _CONVERTERS[type(d)] = _pick_converter(d)
+    try:
+        return conv(d)
+    except Exception:
+        return _doc_to_dict(d)
+
+
+def _describe_doc(doc: Any) -> Dict[str, Any]:
+    """Type and first keys of a doc, for the sample debug log."""
     try:
-        doc = _doc_to_dict(d)
+        return {"type": type(doc).__name__, "keys": list(_convert(doc).keys())[:20]}  # don't spam logs
     except Exception:
-        return default
+        return {"type": type(doc).__name__, "keys": ["<could not convert>"]}
 
-    if not isinstance(doc, dict):
-        return default
 
-    lowered = {k.lower(): v for k, v in doc.items()}
+# candidate field names (lowercased once at import)
+_LEVEL_KEYS = ("level", "severity")
+_APP_NAME_KEYS = ("appname", "app_name", "application")
+_LOG_MARKER_KEYS = ("level", "message", "appname", "requestid")
+
+
+def _lower_view(d: Any) -> Dict[str, Any]:
+    """Lowercase the keys once per doc so every field lookup reuses the same dict."""
+    return {k.lower(): v for k, v in d.items()} if isinstance(d, dict) else {}
+
+
+def _pick(lowered: Dict[str, Any], keys, default=None):
     for k in keys:
-        if k is None:
-            continue
-        v = lowered.get(k.lower())
+        v = lowered.get(k)
         if v is not None:
             return v
     return default
 
 
+def _classify_level(lvl: str) -> str:
+    """Bucket a lowercased level as "error" / "warn" / "info"."""
+    return "error" if "error" in lvl else "warn" if "warn" in lvl else "info"
+
+
 def handle_cosmos_changes(documents: Iterable[Any]):
     """
     Called by function_app.py when Cosmos DB change feed raises documents.
@@ -99,61 +145,55 @@ def handle_cosmos_changes(documents: Iterable[Any]):
     implementation normalizes them and counts levels safely.
     """
     try:
-        # small sanity debug: log the types / keys of first few docs
-        sample_docs = []
-        for i, doc in enumerate(documents):
-            if i >= 5:
-                break
-            try:
-                converted = _doc_to_dict(doc)
-                sample_docs.append({
-                    "type": type(doc).__name__,
-                    "keys": list(converted.keys())[:20]  # don't spam logs
-                })
-            except Exception:
-                sample_docs.append({"type": type(doc).__name__, "keys": ["<could not convert>"]})
-
-        logging.info(f"Cosmos trigger received {len(list(documents))} docs (sample types/keys): {json.dumps(sample_docs, default=str)}")
-
-        # Re-iterate properly: documents might be a generator-like; convert to list
+        # materialize once: documents might be a generator-like
         docs = list(documents)
+
+        # small sanity debug: log the types / keys of first few docs
+        sample_docs = [_describe_doc(doc) for doc in docs[:5]]
+        logging.info(f"Cosmos trigger received {len(docs)} docs (sample types/keys): {_json_dumps(sample_docs)}")
+
         if not docs:
             logging.info("No documents to process.")
             return
 
-        error_count = 0
-        warning_count = 0
-        info_count = 0
-        service_errors = {}
+        level_counts = Counter()    # "error" / "warn" / "info"
+        service_errors = Counter()
 
         processed = 0
         for raw_doc in docs:
             processed += 1
-            # normalize to dict for flexible key access
-            doc = _doc_to_dict(raw_doc)
-
-            # Defensive: skip insight docs or system docs if they don't look like logs
-            # Consider a log doc to have at least one of these keys: Level, Message, AppName, RequestId
-            if not any(k in {k_.lower() for k_ in doc.keys()} for k in ("level", "message", "appname", "requestid")):
-                logging.debug(f"Skipping non-log doc (id if present): {doc.get('id') if isinstance(doc, dict) else '<unknown>'}")
-                continue
-
-            level = _flex_get(doc, ["Level", "level", "Severity", "severity"], default="Information")
-            app_name = _flex_get(doc, ["AppName", "app_name", "Application"], default="Unknown")
-
-            # defensive normalize: sometimes level stored under OriginalPayload.Level
-            if level is None or (isinstance(level, str) and level.strip() == ""):
-                orig = doc.get("OriginalPayload") or {}
-                level = _flex_get(orig, ["Level", "level", "Severity", "severity"], default="Information")
-
-            lvl = str(level).lower() if level is not None else "information"
-            if "error" in lvl:
-                error_count += 1
-                service_errors[app_name] = service_errors.get(app_name, 0) + 1
-            elif "warn" in lvl:
-                warning_count += 1
+
+            # Fast path: queue_trigger always writes canonical Level / AppName fields
+            level = raw_doc.get("Level") if hasattr(raw_doc, "get") else None
+            if isinstance(level, str) and level.strip():
+                app_name = raw_doc.get("AppName") or "Unknown"
             else:
-                info_count += 1
+                # normalize to dict for flexible key access
+                doc = _convert(raw_doc)
+                lowered = _lower_view(doc)
+
+                # Defensive: skip insight docs or system docs if they don't look like logs
+                # Consider a log doc to have at least one of these keys: Level, Message, AppName, RequestId
+                if not any(k in lowered for k in _LOG_MARKER_KEYS):
+                    logging.debug(f"Skipping non-log doc (id if present): {doc.get('id') if isinstance(doc, dict) else '<unknown>'}")
+                    continue
+
+                level = _pick(lowered, _LEVEL_KEYS, default="Information")
+                app_name = _pick(lowered, _APP_NAME_KEYS, default="Unknown")
+
+                # defensive normalize: sometimes level stored under OriginalPayload.Level
+                if level is None or (isinstance(level, str) and level.strip() == ""):
+                    orig = _convert(lowered.get("originalpayload") or {})
+                    level = _pick(_lower_view(orig), _LEVEL_KEYS, default="Information")
+
+            lvl_class = _classify_level(str(level).lower() if level is not None else "information")
+            level_counts[lvl_class] += 1
+            if lvl_class == "error":
+                service_errors[app_name] += 1
+
+        error_count = level_counts["error"]
+        warning_count = level_counts["warn"]
+        info_count = level_counts["info"]
 
         total = error_count + warning_count + info_count
         error_rate = round((error_count / total) * 100, 2) if total > 0 else 0
@@ -165,7 +205,7 @@ def handle_cosmos_changes(documents: Iterable[Any]):
         else:
             status = "STABLE"
 
-        top_service = max(service_errors, key=service_errors.get) if service_errors else "None"
+        top_service = service_errors.most_common(1)[0][0] if service_errors else "None"
 
         insight_doc = {
             "id": str(uuid.uuid4()),
@@ -178,14 +218,15 @@ def handle_cosmos_changes(documents: Iterable[Any]):
             "error_rate_percent": error_rate,
             "status": status,
             "top_error_service": top_service,
-            "service_error_breakdown": service_errors
+            "service_error_breakdown": dict(service_errors)
         }
 
         # debug log to show what we'll upsert
-        logging.info(f"Computed insight: {json.dumps({k: insight_doc[k] for k in ['id','total_logs','error_count','warning_count','info_count','status']})}")
+        logging.info(f"Computed insight: {_json_dumps({k: insight_doc[k] for k in ['id','total_logs','error_count','warning_count','info_count','status']})}")
 
-        if _insight_container:
-            _insight_container.upsert_item(insight_doc)
+        container = insights_container()
+        if container:
+            container.upsert_item(insight_doc)
             logging.info(f" Insight added to {INSIGHT_CONTAINER}: {status} (Errors={error_count}, Warnings={warning_count})")
         else:
             logging.warning("Insight container client not available; skipping upsert.")
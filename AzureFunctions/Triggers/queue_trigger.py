@@ -1,66 +1,170 @@
 # Triggers/queue_trigger.py
 import os
+import re
 import json
 import logging
 import time
-import threading
-from typing import Iterable, Any, Dict
-from azure.cosmos import CosmosClient, exceptions as cosmos_exceptions
+from typing import Iterable, Any, Dict, Optional
+from azure.cosmos import exceptions as cosmos_exceptions
 from azure.cosmos.exceptions import CosmosHttpResponseError  # correct import
 # NOTE: if CosmosHttpResponseError import fails in your environment,
 # use: from azure.cosmos.exceptions import CosmosHttpResponseError
+from shared.cosmos_singleton import logs_container
 
-# Thread-safe global Cosmos client (reuse connection across all calls)
-_cosmos_lock = threading.Lock()
-_cosmos_client = None
-_db = None
-_container = None
+# orjson is much faster than stdlib json on the per-message path; fall back if missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
 # ---------- configuration ----------
-COSMOS_CONN = os.getenv("COSMOSDB_CONN_STRING")
-COSMOS_DB = os.getenv("COSMOSDB_DB_NAME", "ProcessedLogs")
-COSMOS_CONTAINER = os.getenv("COSMOSDB_CONTAINER_NAME", "LogsStored")
+# override for the container's partition key path (e.g. "/AppName"); read from the container if unset
+COSMOS_PARTITION_KEY = os.getenv("COSMOSDB_PARTITION_KEY")
+# Cosmos transactional batches accept at most 100 operations
+MAX_BATCH_OPERATIONS = 100
+# content type producers set on MessagePack-framed messages (anything else is treated as JSON)
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+# 4xx statuses that are still worth a redelivery; any other 4xx means the document itself is rejected
+TRANSIENT_4XX = {408, 429, 449}
 # -----------------------------------
 
+if msgspec:
+    class LogMsg(msgspec.Struct, rename="pascal"):
+        """Canonical log payload as sent by the ingestion API (RequestId, AppName, Level, ...)."""
+        request_id: Optional[str] = None
+        app_name: str = "Unknown"
+        level: str = "Information"
+        message: Optional[str] = None
+        timestamp: Optional[str] = msgspec.field(default=None, name="TimeGenerated")
+        user_id: Optional[str] = None
+        status_code: Optional[int] = None
+        file_name: Optional[str] = None
+else:
+    LogMsg = None
+
+# keys that mark a payload as canonical, so it can skip the flexible key lookup
+_CANONICAL_KEYS = ("AppName", "Level")
+
+
+_msgpack_decoder = msgspec.msgpack.Decoder() if msgspec else None
+# partition key path split into fields (e.g. ("AppName",)); resolved once per process
+_partition_key_fields = None
+
+
 def _get_container():
-    global _cosmos_client, _db, _container
-    if _container:
-        return _container
-    with _cosmos_lock:
-        if _container:
-            return _container
-        if not COSMOS_CONN:
-            raise RuntimeError("COSMOSDB_CONN_STRING environment variable not set.")
-        # avoid certificate verification warnings in dev; recommended: remove connection_verify=False in prod
-        _cosmos_client = CosmosClient.from_connection_string(COSMOS_CONN, connection_verify=False)
-        _db = _cosmos_client.get_database_client(COSMOS_DB)
-        _container = _db.get_container_client(COSMOS_CONTAINER)
-    return _container
-
-
-def _safe_json_load(s: str):
+    container = logs_container()
+    if not container:
+        raise RuntimeError("COSMOSDB_CONN_STRING environment variable not set.")
+    return container
+
+
+def _get_partition_key_fields(container):
+    """Fields of the partition key path: the COSMOSDB_PARTITION_KEY override, else the container's own."""
+    global _partition_key_fields
+    if _partition_key_fields is None:
+        path = COSMOS_PARTITION_KEY or container.read()["partitionKey"]["paths"][0]
+        _partition_key_fields = tuple(p for p in path.split("/") if p)
+        logging.info(f"Grouping queue batches by partition key /{'/'.join(_partition_key_fields)}")
+    return _partition_key_fields
+
+
+def _partition_key_value(doc, fields):
+    """
+    Partition key value of doc, or None if the path is missing or not a scalar
+    (those docs are upserted singly and left to Cosmos to accept or reject).
+    """
+    value = doc
+    for f in fields:
+        if not isinstance(value, dict) or value.get(f) is None:
+            return None
+        value = value[f]
+    return value if isinstance(value, (str, int, float, bool)) else None
+
+
+def _json_dumps(obj) -> str:
+    if orjson:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str)
+
+
+# orjson silently parses integers wider than 64 bits as floats; such bodies go to stdlib json
+_LONG_INT_RE = re.compile(rb"\d{20,}")
+
+
+def _safe_json_load(s):
     try:
+        if orjson and isinstance(s, bytes) and not _LONG_INT_RE.search(s):
+            return orjson.loads(s)
         return json.loads(s)
     except Exception:
+        if isinstance(s, bytes):
+            s = s.decode("utf-8", errors="replace")
+        # stdlib json accepts what orjson's stricter parser rejects (NaN, big ints, ...)
+        try:
+            return json.loads(s)
+        except Exception:
+            pass
         try:
             return json.loads(s.replace("'", '"'))
         except Exception:
             return {"raw": s}
 
 
-def _get_value_flex(obj: Dict[str, Any], candidates: Iterable[str], default=None):
-    if not isinstance(obj, dict):
-        return default
-    lowered = {k.lower(): v for k, v in obj.items()}
+def _safe_msgpack_load(b: bytes):
+    try:
+        return _msgpack_decoder.decode(b)
+    except Exception:
+        logging.warning("Message declared msgpack but could not be decoded; trying JSON.")
+        return _safe_json_load(b)
+
+
+def _keys(*names: str):
+    """Lowercased, de-duplicated candidate keys (built once at import)."""
+    return tuple(dict.fromkeys(n.lower() for n in names))
+
+
+# candidate field names for non-canonical payloads, in priority order
+_REQUEST_ID_KEYS = _keys("RequestId", "request_id", "id", "Id")
+_APP_NAME_KEYS = _keys("AppName", "app_name", "application")
+_LEVEL_KEYS = _keys("Level", "level", "severity")
+_MESSAGE_KEYS = _keys("Message", "message", "msg", "log")
+_TIMESTAMP_KEYS = _keys("TimeGenerated", "timestamp", "time", "Time")
+_USER_ID_KEYS = _keys("UserId", "user_id", "User")
+_STATUS_CODE_KEYS = _keys("StatusCode", "status_code", "status")
+_FILE_NAME_KEYS = _keys("FileName", "file", "filename")
+
+
+def _lower_view(obj) -> Dict[str, Any]:
+    """Lowercase the keys once per payload so every field lookup reuses the same dict."""
+    return {k.lower(): v for k, v in obj.items()} if isinstance(obj, dict) else {}
+
+
+def _pick(lowered: Dict[str, Any], candidates: Iterable[str], default=None):
     for c in candidates:
-        if c is None:
-            continue
-        v = lowered.get(c.lower())
+        v = lowered.get(c)
         if v is not None:
             return v
     return default
 
 
+def _to_log_msg(payload) -> Optional["LogMsg"]:
+    """
+    Convert a canonical payload dict to LogMsg in one call; None if it needs the flexible path.
+    strict: a payload whose types don't match (e.g. "StatusCode": "503") keeps its values as sent.
+    """
+    if not LogMsg or not isinstance(payload, dict) or not all(k in payload for k in _CANONICAL_KEYS):
+        return None
+    try:
+        return msgspec.convert(payload, LogMsg, strict=True)
+    except msgspec.ValidationError:
+        return None
+
+
 def _safe_upsert(container, doc, retries=5):
     """Retry on 429 or transient network issues."""
     for i in range(retries):
@@ -81,6 +185,66 @@ def _safe_upsert(container, doc, retries=5):
             raise
 
 
+def _safe_batch_upsert(container, pk, docs, retries=5):
+    """
+    Upsert docs sharing one partition key as a single transactional batch.
+    Retries the batch on 429; if the batch is rejected for any other reason it is
+    all-or-nothing, so fall back to per-doc upserts to isolate the failing document.
+    Returns the ids of docs that could not be stored.
+    """
+    operations = [("upsert", (doc,)) for doc in docs]
+    for i in range(retries):
+        try:
+            container.execute_item_batch(batch_operations=operations, partition_key=pk)
+            return []
+        except cosmos_exceptions.CosmosBatchOperationError as e:
+            failed = e.operation_responses[e.error_index] if e.operation_responses else {}
+            status = failed.get("statusCode") if isinstance(failed, dict) else None
+            logging.warning(f"Cosmos batch error (attempt {i+1}/{retries}): op {e.error_index} failed (status={status})")
+            if status == 429:
+                time.sleep(0.5 * (i + 1))
+                continue
+            break
+        except cosmos_exceptions.CosmosHttpResponseError as e:
+            status = getattr(e, "status_code", None)
+            logging.warning(f"Cosmos batch error (attempt {i+1}/{retries}): {e} (status={status})")
+            if status == 429:
+                time.sleep(0.5 * (i + 1))
+                continue
+            break
+
+    # batch kept failing: write the docs one by one so only the bad ones are reported
+    return _upsert_each(container, docs, retries=retries)
+
+
+def _is_permanent_failure(e) -> bool:
+    """A 4xx Cosmos rejection that a redelivery would only repeat."""
+    status = getattr(e, "status_code", None)
+    return (
+        isinstance(e, cosmos_exceptions.CosmosHttpResponseError)
+        and isinstance(status, int) and 400 <= status < 500 and status not in TRANSIENT_4XX
+    )
+
+
+def _upsert_each(container, docs, retries=5):
+    """
+    Upsert docs one at a time; returns the ids of those that failed transiently.
+    Docs Cosmos rejects outright are logged and skipped, so they don't hold back the batch.
+    """
+    failed = []
+    for doc in docs:
+        try:
+            _safe_upsert(container, doc, retries=retries)
+        except Exception as e:
+            if _is_permanent_failure(e):
+                logging.error(f"Skipping log {doc.get('id')} rejected by Cosmos (status={e.status_code}): "
+                              f"{_json_dumps(doc)[:1000]}")
+                continue
+            logging.error(f"Failed to store log {doc.get('id')}: {e}")
+            failed.append(doc.get("id"))
+    return failed
+
+
 def _extract_system_props(sb_msg) -> Dict[str, Any]:
     """
     Try to pull as much metadata as possible from the azure.functions.ServiceBusMessage object.
@@ -109,69 +273,144 @@ def _extract_system_props(sb_msg) -> Dict[str, Any]:
     return meta
 
 
-def handle_message(azservicebus):
+def _generated_id(sys_meta: Dict[str, Any]) -> str:
     """
-    Called by function_app.process_log_message.
-    azservicebus is azure.functions.ServiceBusMessage.
+    id for a payload without a RequestId. Derived from the Service Bus message so a
+    redelivered message overwrites its earlier document instead of adding a duplicate.
     """
-    try:
-        logging.info("Queue handler start.")
-        sys_meta = _extract_system_props(azservicebus)
-        logging.info(f"ServiceBus metadata: {json.dumps(sys_meta, default=str)}")
+    for key in ("message_id", "MessageId", "sequence_number", "SequenceNumber"):
+        if sys_meta.get(key) is not None:
+            return f"generated-{sys_meta[key]}"
+    return f"generated-{os.urandom(8).hex()}"
 
-        raw = None
-        try:
-            if hasattr(azservicebus, "get_body"):
-                raw = azservicebus.get_body().decode("utf-8")
-            else:
-                raw = str(azservicebus)
-        except Exception:
+
+def _build_enriched_log(azservicebus) -> Dict[str, Any]:
+    """Parse one ServiceBusMessage and build the enriched document stored in Cosmos."""
+    sys_meta = _extract_system_props(azservicebus)
+    logging.info(f"ServiceBus metadata: {_json_dumps(sys_meta)}")
+
+    raw = None
+    try:
+        if hasattr(azservicebus, "get_body"):
+            # orjson parses the raw bytes directly; no need to decode to str first
+            raw = azservicebus.get_body()
+        else:
             raw = str(azservicebus)
+    except Exception:
+        raw = str(azservicebus)
 
+    if _msgpack_decoder and isinstance(raw, bytes) and getattr(azservicebus, "content_type", None) == MSGPACK_CONTENT_TYPE:
+        payload = _safe_msgpack_load(raw)
+    else:
         payload = _safe_json_load(raw)
 
-        # Unwrap common envelope shapes
-        if isinstance(payload, dict) and len(payload) == 1 and next(iter(payload)).lower() in ("message", "body", "data"):
-            inner = next(iter(payload.values()))
-            if isinstance(inner, dict):
-                payload = inner
+    # Unwrap common envelope shapes
+    if isinstance(payload, dict) and len(payload) == 1 and next(iter(payload)).lower() in ("message", "body", "data"):
+        inner = next(iter(payload.values()))
+        if isinstance(inner, dict):
+            payload = inner
 
+    msg = _to_log_msg(payload)
+    if msg is not None:
+        # Canonical payload: fields come straight from the struct
+        request_id = msg.request_id
+        app_name = msg.app_name
+        level = msg.level
+        message = msg.message
+        timestamp = msg.timestamp
+        user_id = msg.user_id
+        status_code = msg.status_code
+        file_name = msg.file_name
+        if None in (request_id, message, timestamp, user_id, status_code, file_name):
+            # fields the struct left unset may still be sent under an alias (request_id, message, time, ...)
+            lowered = _lower_view(payload)
+            if request_id is None:
+                request_id = _pick(lowered, _REQUEST_ID_KEYS)
+            if message is None:
+                message = _pick(lowered, _MESSAGE_KEYS, str(payload)[:500])
+            if timestamp is None:
+                timestamp = _pick(lowered, _TIMESTAMP_KEYS)
+            if user_id is None:
+                user_id = _pick(lowered, _USER_ID_KEYS)
+            if status_code is None:
+                status_code = _pick(lowered, _STATUS_CODE_KEYS)
+            if file_name is None:
+                file_name = _pick(lowered, _FILE_NAME_KEYS)
+    else:
         # Extract fields (flexible)
-        request_id = _get_value_flex(payload, ["RequestId", "request_id", "id", "Id"])
-        app_name = _get_value_flex(payload, ["AppName", "app_name", "application"], "Unknown")
-        level = _get_value_flex(payload, ["Level", "level", "severity"], "Information")
-        message = _get_value_flex(payload, ["Message", "message", "msg", "log"], str(payload)[:500])
-        timestamp = _get_value_flex(payload, ["TimeGenerated", "timestamp", "time", "Time"])
-        user_id = _get_value_flex(payload, ["UserId", "user_id", "User"])
-        status_code = _get_value_flex(payload, ["StatusCode", "status_code", "status"])
-        file_name = _get_value_flex(payload, ["FileName", "file", "filename"])
-
-        lvl = str(level).lower()
-        severity = "High" if "error" in lvl else "Medium" if "warn" in lvl else "Low"
-
-        enriched_log = {
-            "id": request_id or f"generated-{os.urandom(8).hex()}",
-            "AppName": app_name,
-            "Level": level,
-            "Message": message,
-            "Severity": severity,
-            "UserId": user_id,
-            "StatusCode": status_code,
-            "FileName": file_name,
-            "Timestamp": timestamp,
-            # Add ServiceBus metadata so you can trace queue -> cosmos document
-            "ServiceBusMetadata": sys_meta,
-            # store original body (but avoid huge blobs if you have them)
-            "OriginalPayload": payload
-        }
+        lowered = _lower_view(payload)
+        request_id = _pick(lowered, _REQUEST_ID_KEYS)
+        app_name = _pick(lowered, _APP_NAME_KEYS, "Unknown")
+        level = _pick(lowered, _LEVEL_KEYS, "Information")
+        message = _pick(lowered, _MESSAGE_KEYS, str(payload)[:500])
+        timestamp = _pick(lowered, _TIMESTAMP_KEYS)
+        user_id = _pick(lowered, _USER_ID_KEYS)
+        status_code = _pick(lowered, _STATUS_CODE_KEYS)
+        file_name = _pick(lowered, _FILE_NAME_KEYS)
+
+    lvl = str(level).lower()
+    severity = "High" if "error" in lvl else "Medium" if "warn" in lvl else "Low"
+
+    enriched_log = {
+        "id": request_id or _generated_id(sys_meta),
+        "AppName": app_name,
+        "Level": level,
+        "Message": message,
+        "Severity": severity,
+        "UserId": user_id,
+        "StatusCode": status_code,
+        "FileName": file_name,
+        "Timestamp": timestamp,
+        # Add ServiceBus metadata so you can trace queue -> cosmos document
+        "ServiceBusMetadata": sys_meta,
+        # store original body (but avoid huge blobs if you have them)
+        "OriginalPayload": payload
+    }
+    return enriched_log
+
 
+def handle_messages(messages: Iterable[Any]):
+    """
+    Called by function_app.process_log_message when the trigger delivers a batch.
+    Enriched logs are grouped by partition key and written with one transactional batch per group.
+    Every message is attempted. Messages that can't be parsed and docs Cosmos rejects outright
+    (non-retryable 4xx) are logged and skipped; if any doc failed transiently (429, 5xx, network),
+    raise once at the end so the batch is redelivered. Document ids are stable across deliveries,
+    so the redelivered batch re-upserts the stored ones without duplicating them.
+    """
+    try:
+        logging.info("Queue batch handler start.")
         container = _get_container()
-        _safe_upsert(container, enriched_log)
-        logging.info(f"Stored/enriched log: {enriched_log['id']} (App={app_name} Level={level})")
+        pk_fields = _get_partition_key_fields(container)
+
+        failed = []
+        groups: Dict[Any, list] = {}
+        unkeyed = []
+        count = 0
+        for azservicebus in messages:
+            try:
+                enriched_log = _build_enriched_log(azservicebus)
+            except Exception as e:
+                # a redelivery would parse the same body the same way
+                logging.exception(f"Skipping unparseable queue message {getattr(azservicebus, 'message_id', None)}: {e}")
+                continue
+            count += 1
+            pk = _partition_key_value(enriched_log, pk_fields)
+            if pk is None:
+                unkeyed.append(enriched_log)
+            else:
+                groups.setdefault(pk, []).append(enriched_log)
+
+        for pk, docs in groups.items():
+            for i in range(0, len(docs), MAX_BATCH_OPERATIONS):
+                failed.extend(_safe_batch_upsert(container, pk, docs[i:i + MAX_BATCH_OPERATIONS]))
+        failed.extend(_upsert_each(container, unkeyed))
+
+        if failed:
+            raise RuntimeError(f"{len(failed)} queue message(s) not stored (transient): {failed}")
+        logging.info(f"Stored/enriched {count} logs in {len(groups)} partition batches.")
 
     except Exception as e:
-        logging.exception(f"Error in queue handle_message: {e}")
-        # If the function raises, with autoComplete=false the runtime will abandon -> delivery_count++.
-        # With autoComplete=true, the runtime completes if function returns without raising.
-        # We re-raise to let the host know there was a failure (if appropriate).
+        logging.exception(f"Error in queue handle_messages: {e}")
+        # If the function raises, the host abandons the batch -> delivery_count++ and redelivery.
         raise
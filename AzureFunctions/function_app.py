@@ -1,6 +1,7 @@
 import os
 import sys
 import logging
+from typing import List
 import azure.functions as func
 
 ROOT = os.path.dirname(__file__)
@@ -16,13 +17,14 @@ app = func.FunctionApp()
 @app.service_bus_queue_trigger(
     arg_name="azservicebus",
     queue_name="logqueue",
-    connection="LogPassing_SERVICEBUS"  # must match Azure App Setting name
+    connection="LogPassing_SERVICEBUS",  # must match Azure App Setting name
+    cardinality=func.Cardinality.MANY  # batch size comes from host.json batchOptions
 )
-def process_log_message(azservicebus: func.ServiceBusMessage):
-    logging.info("Queue trigger received a message.")
+def process_log_message(azservicebus: List[func.ServiceBusMessage]):
+    logging.info(f"Queue trigger received {len(azservicebus)} messages.")
     try:
-        queue_trigger.handle_message(azservicebus)
-        logging.info(" Queue trigger successfully processed message.")
+        queue_trigger.handle_messages(azservicebus)
+        logging.info(" Queue trigger successfully processed messages.")
     except Exception as e:
         logging.exception(f" Queue handler failed: {e}")
         raise e  # ensures retries before DLQ
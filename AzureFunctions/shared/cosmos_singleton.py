@@ -0,0 +1,70 @@
+# shared/cosmos_singleton.py
+import os
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
+from azure.cosmos import CosmosClient
+
+# ---------- configuration ----------
+COSMOS_CONN = os.getenv("COSMOSDB_CONN_STRING")
+COSMOS_DB = os.getenv("COSMOSDB_DB_NAME", "ProcessedLogs")
+LOGS_CONTAINER = os.getenv("COSMOSDB_CONTAINER_NAME", "LogsStored")
+INSIGHT_CONTAINER = os.getenv("COSMOSDB_INSIGHT_CONTAINER", "TriggerInsights")
+# HTTP connection pool shared by every trigger in this worker process
+MAX_CONNECTIONS = int(os.getenv("COSMOSDB_MAX_CONNECTIONS", "100"))
+# only for the local emulator's self-signed cert; keep verification on in Azure
+DISABLE_SSL_VERIFY = os.getenv("COSMOSDB_DISABLE_SSL_VERIFY", "false").lower() == "true"
+# -----------------------------------
+
+# One process-wide Cosmos client so both triggers share sockets / TLS sessions
+_lock = threading.Lock()
+_client = None
+_containers = {}
+
+
+def get_client():
+    """Return the process-wide CosmosClient (None if COSMOSDB_CONN_STRING is not set)."""
+    global _client
+    if _client or not COSMOS_CONN:
+        return _client
+    with _lock:
+        if _client:
+            return _client
+        # the Python SDK only speaks Gateway mode, so the win here is a bigger keep-alive pool
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _client = CosmosClient.from_connection_string(
+            COSMOS_CONN,
+            consistency_level="Session",
+            transport=RequestsTransport(session=session, session_owner=False),
+            connection_verify=not DISABLE_SSL_VERIFY,
+        )
+        logging.info(f"Cosmos client initialized (pool size={MAX_CONNECTIONS}).")
+    return _client
+
+
+def _get_container(name: str):
+    container = _containers.get(name)
+    if container:
+        return container
+    client = get_client()
+    if not client:
+        return None
+    container = client.get_database_client(COSMOS_DB).get_container_client(name)
+    _containers[name] = container
+    return container
+
+
+def logs_container():
+    """Container the queue trigger writes enriched logs to."""
+    return _get_container(LOGS_CONTAINER)
+
+
+def insights_container():
+    """Container the change-feed trigger writes insights to."""
+    return _get_container(INSIGHT_CONTAINER)
@@ -1,32 +1,43 @@
 import os
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
 from azure.cosmos import CosmosClient
 from dotenv import load_dotenv
 from pathlib import Path
 
 
 env_path = Path(r"D:\Revature_assignments\Intelligent_log_insights\.env")
-load_dotenv(dotenv_path=env_path, override=True)
 
 if not env_path.exists():
     raise FileNotFoundError(f" .env not found at {env_path}")
 
-# Force reload
 load_dotenv(dotenv_path=env_path, override=True)
 
 COSMOS_CONN = os.getenv("COSMOS_CONN_STRING")
 DB_NAME = os.getenv("COSMOSDB_DB_NAME")
 LOGS_CONTAINER = os.getenv("COSMOSDB_CONTAINER_NAME")
 INSIGHTS_CONTAINER = os.getenv("COSMOSDB_INSIGHT_CONTAINER")
+# keep-alive pool shared by all API worker threads
+MAX_CONNECTIONS = int(os.getenv("COSMOSDB_MAX_CONNECTIONS", "100"))
 
 
 
 if not COSMOS_CONN:
     raise ValueError(" Missing COSMOSDB_CONN_STRING. Check your .env file format or encoding.")
 
-#  Initialize Cosmos DB
-client = CosmosClient.from_connection_string(COSMOS_CONN)
+#  Initialize Cosmos DB (one client for the whole process; the Python SDK is Gateway-only,
+#  so size the HTTP pool instead of switching connection mode)
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+client = CosmosClient.from_connection_string(
+    COSMOS_CONN,
+    consistency_level="Session",
+    transport=RequestsTransport(session=_session, session_owner=False),
+)
 db = client.get_database_client(DB_NAME)
 logs_container = db.get_container_client(LOGS_CONTAINER)
 insights_container = db.get_container_client(INSIGHTS_CONTAINER)
-
-
@@ -1,13 +1,23 @@
 import os
+import re
 import json
 import time
+import tempfile
+import threading
+from functools import lru_cache
 import torch
+import numpy as np
 from datetime import datetime, timedelta, timezone
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 from .cosmos_client import logs_container, insights_container
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # ==============================================================
 #  Setup Environment & Model
@@ -15,12 +25,25 @@ from .cosmos_client import logs_container, insights_container
 load_dotenv()
 hf_token = os.getenv("HUGGINGFACE_HUB_TOKEN", None)
 model_name = "sentence-transformers/all-MiniLM-L6-v2"
+# bf16 autocast on CPU only pays off on CPUs with native bf16 (AVX512-BF16 / AMX), so it is opt-in
+cpu_bf16 = os.getenv("EMBED_CPU_BF16", "false").lower() == "true"
+# fuse the transformer kernels with torch.compile (opt-in; any compile failure reverts to eager)
+torch_compile = os.getenv("EMBED_TORCH_COMPILE", "false").lower() == "true"
+_eager_encoder = None
 
 print(f" Loading model: {model_name} ...")
 try:
     model = SentenceTransformer(model_name, token=hf_token)
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model.to(device)
+    if device == "cuda":
+        # FP16 halves memory traffic and runs the matmuls on tensor cores
+        model.half()
+    if torch_compile and hasattr(torch, "compile"):
+        # compilation is lazy; the warmup below triggers it (and reverts to eager if it fails).
+        # No CUDA graphs ("reduce-overhead"): their state is thread-local and searches run on worker threads.
+        _eager_encoder = model[0].auto_model
+        model[0].auto_model = torch.compile(_eager_encoder, mode="default", dynamic=True)
     print(f" Model loaded successfully on {device}")
 except Exception as e:
     print(f" Failed to load SentenceTransformer: {e}")
@@ -31,7 +54,41 @@ except Exception as e:
 #  Paths & Constants
 # ==============================================================
 HISTORY_PATH = "search_results.json"
-CACHE = {"logs": [], "insights": [], "last_refresh": None}
+# query keywords -> intent; matched as substrings of the lowercased query
+INTENT_KEYWORDS = {
+    "service_level": ("error", "service", "critical"),
+    "system_health": ("system", "stable", "health", "trend"),
+    "failure": ("fail", "failed", "failure", "error", "critical", "issue", "crash"),
+}
+_KEYWORD_INTENTS = {}
+for _intent, _words in INTENT_KEYWORDS.items():
+    for _word in _words:
+        _KEYWORD_INTENTS.setdefault(_word, set()).add(_intent)
+# one pass over the query; the lookahead lets overlapping keywords all match
+_INTENT_RE = re.compile(
+    "(?=(" + "|".join(re.escape(w) for w in sorted(_KEYWORD_INTENTS, key=len, reverse=True)) + "))"
+)
+# (lowercased query, top_k) -> response body (no query/timestamp), for the current cache snapshot only (LRU)
+RESP_CACHE_SIZE = 128
+_RESP_CACHE = OrderedDict()
+_resp_cache_token = None
+_resp_cache_lock = threading.Lock()
+# in-memory copy of the history file, so saving a search doesn't re-read it
+_HISTORY = None
+_history_lock = threading.Lock()
+# corpus = logs + insights; "corpus_emb" rows and "meta" lists are aligned with it
+CACHE = {"logs": [], "insights": [], "last_refresh": None, "corpus_emb": None, "meta": {}}
+# corpus caps (these were the page sizes used before) and the only fields the search reads
+MAX_LOGS = 2000
+MAX_INSIGHTS = 500
+LOG_FIELDS = "c.id, c._ts, c.AppName, c.Level, c.Message, c.Timestamp, c.Severity"
+INSIGHT_FIELDS = "c.id, c._ts, c.status, c.error_rate_percent, c.error_count, c.top_error_service, c.timestamp"
+# doc key -> normalized embedding; lets refreshes encode only docs not seen before
+_EMB_CACHE = {}
+# searches run on worker threads: one refresh at a time, and _EMB_CACHE is only touched under this lock
+_emb_lock = threading.RLock()
+# fields returned for semantic matches (with their defaults)
+META_FIELDS = {"AppName": "Unknown", "Level": "N/A", "Message": "", "Timestamp": "N/A", "Severity": "N/A"}
 
 
 # ==============================================================
@@ -43,8 +100,9 @@ def load_history():
         return {"service_level": [], "system_health": [], "semantic": []}
 
     try:
-        with open(HISTORY_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(HISTORY_PATH, "rb") as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
         if isinstance(data, list):
             data = {"service_level": [], "system_health": [], "semantic": data}
         elif not isinstance(data, dict):
@@ -57,26 +115,56 @@ def load_history():
 
 def save_history(entry: dict):
     """Save structured search results (grouped by query type)."""
+    global _HISTORY
+    tmp_path = None
     try:
-        history = load_history()
-        query_type = entry.get("type", "semantic")
-        if query_type not in history:
-            history[query_type] = []
-
-        history[query_type].append(entry)
-        history[query_type] = history[query_type][-10:]
-
-        with open(HISTORY_PATH, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2)
+        # searches save from several threads: update, serialize and swap in one at a time
+        with _history_lock:
+            if _HISTORY is None:
+                _HISTORY = load_history()
+            history = _HISTORY
+            query_type = entry.get("type", "semantic")
+            if query_type not in history:
+                history[query_type] = []
+
+            history[query_type].append(entry)
+            history[query_type] = history[query_type][-10:]
+
+            if orjson:
+                data = orjson.dumps(history, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(history, indent=2).encode("utf-8")
+
+            # write to a unique temp file and swap it in, so a crash never leaves a half-written history
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(HISTORY_PATH) + ".", suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(HISTORY_PATH))
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, HISTORY_PATH)
     except Exception as e:
         print(f"Failed to save history: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 # ==============================================================
 #  CosmosDB Data Fetch & Caching
 # ==============================================================
+def _query_capped(container, query, limit):
+    """Stream query pages and stop once `limit` docs are collected."""
+    collected = []
+    pages = container.query_items(query=query, enable_cross_partition_query=True, max_item_count=limit).by_page()
+    for page in pages:
+        collected.extend(page)
+        if len(collected) >= limit:
+            break
+    return collected[:limit]
+
+
 def fetch_all_data(hours: int = None):
-    """Fetch all logs & insights (optionally filtered by time)."""
+    """Fetch the most recent logs & insights (optionally filtered by time), projected to the fields used."""
     try:
         if hours:
             since_ts = int((datetime.now(timezone.utc) - timedelta(hours=hours)).timestamp())
@@ -84,11 +172,11 @@ def fetch_all_data(hours: int = None):
         else:
             time_filter = ""
 
-        logs_query = f"SELECT * FROM c {time_filter} ORDER BY c._ts DESC"
-        insights_query = f"SELECT * FROM c {time_filter} ORDER BY c._ts DESC"
+        logs_query = f"SELECT {LOG_FIELDS} FROM c {time_filter} ORDER BY c._ts DESC"
+        insights_query = f"SELECT {INSIGHT_FIELDS} FROM c {time_filter} ORDER BY c._ts DESC"
 
-        logs = list(logs_container.query_items(query=logs_query, enable_cross_partition_query=True, max_item_count=2000))
-        insights = list(insights_container.query_items(query=insights_query, enable_cross_partition_query=True, max_item_count=500))
+        logs = _query_capped(logs_container, logs_query, MAX_LOGS)
+        insights = _query_capped(insights_container, insights_query, MAX_INSIGHTS)
 
         print(f" Loaded {len(logs)} logs and {len(insights)} insights from CosmosDB.")
         return logs, insights
@@ -108,8 +196,35 @@ def refresh_cache(force: bool = False):
             print(f" Cache refreshed recently ({delta:.1f}s ago). Skipping reload.")
             return CACHE
 
-    logs, insights = fetch_all_data()
-    CACHE = {"logs": logs, "insights": insights, "last_refresh": now}
+    with _emb_lock:
+        # another request may have refreshed while this one waited for the lock
+        if CACHE["last_refresh"] and not force and (datetime.now(timezone.utc) - CACHE["last_refresh"]).total_seconds() < 10:
+            return CACHE
+
+        logs, insights = fetch_all_data()
+        corpus = logs + insights
+        keys = [_emb_key(d) for d in corpus]
+
+        # drop embeddings of docs that fell out of the window, then encode only the new ones
+        # (an empty fetch is usually a Cosmos error, so keep the embeddings for the next refresh)
+        if corpus:
+            live = set(keys)
+            for k in [k for k in _EMB_CACHE if k not in live]:
+                del _EMB_CACHE[k]
+        corpus_emb = None
+        if model and corpus:
+            try:
+                corpus_emb = corpus_embeddings(corpus, keys)
+            except Exception as e:
+                print(f" Failed to pre-encode corpus: {e}")
+
+        CACHE = {
+            "logs": logs,
+            "insights": insights,
+            "last_refresh": now,
+            "corpus_emb": corpus_emb,
+            "meta": _corpus_metadata(corpus),
+        }
     print(f" Cache refreshed — {len(logs)} logs, {len(insights)} insights @ {now.isoformat()}")
     return CACHE
 
@@ -117,75 +232,248 @@ def refresh_cache(force: bool = False):
 # ==============================================================
 #  Embedding Helper
 # ==============================================================
+def _encode(texts, use_bf16):
+    with torch.inference_mode(), torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=use_bf16):
+        return model.encode(
+            texts, batch_size=64, show_progress_bar=False,
+            convert_to_tensor=True, normalize_embeddings=True
+        )
+
+
 def encode_texts(texts):
     if not model:
         raise RuntimeError("SentenceTransformer model not loaded.")
     texts = [str(t) if t else "" for t in texts]
-    return model.encode(texts, convert_to_tensor=True, normalize_embeddings=True).to(model.device)
+    use_bf16 = cpu_bf16 and model.device.type == "cpu"
+    try:
+        emb = _encode(texts, use_bf16)
+    except Exception as e:
+        # a new input shape can recompile at request time; don't let that fail the search
+        if _eager_encoder is None or model[0].auto_model is _eager_encoder:
+            raise
+        print(f" torch.compile failed ({e}); using the eager model")
+        model[0].auto_model = _eager_encoder
+        emb = _encode(texts, use_bf16)
+    # keep cached CPU embeddings in fp32 so they stack with the query regardless of the flag
+    return (emb.float() if use_bf16 else emb).to(model.device)
+
+
+@lru_cache(maxsize=256)
+def _query_embedding(text: str):
+    # a query embedded for the API's semantic cache is not encoded again by the search itself
+    return encode_texts([text])
+
+
+def embed(text: str) -> np.ndarray:
+    """Normalized embedding of a query as a float32 numpy vector."""
+    return _query_embedding(text)[0].float().cpu().numpy()
+
+
+def _warmup_model():
+    """Pay the one-time compile / device init cost at import instead of on the first search."""
+    if not model:
+        return
+    # encode_texts reverts to the eager model itself if compilation fails
+    try:
+        encode_texts(["warmup"])
+    except Exception as e:
+        print(f" Model warmup failed: {e}")
+
+
+_warmup_model()
+
+
+def _corpus_text(doc):
+    return f"{doc.get('Message', '')} | App: {doc.get('AppName', '')} | Level: {doc.get('Level', '')}"
+
+
+def _emb_key(doc):
+    # _ts changes when a doc is rewritten, so a re-upserted doc gets re-encoded
+    return (doc["id"], doc.get("_ts")) if doc.get("id") else _corpus_text(doc)
+
+
+def corpus_embeddings(docs, keys=None):
+    """Embeddings for docs (one row each), encoding only those not already cached."""
+    if keys is None:
+        keys = [_emb_key(d) for d in docs]
+    with _emb_lock:
+        missing = {}
+        for k, d in zip(keys, docs):
+            if k not in _EMB_CACHE and k not in missing:
+                missing[k] = _corpus_text(d)
+
+        if missing:
+            for k, emb in zip(missing, encode_texts(list(missing.values()))):
+                _EMB_CACHE[k] = emb
+
+        return torch.stack([_EMB_CACHE[k] for k in keys])
 
 
 # ==============================================================
 #  Semantic Search
 # ==============================================================
-def semantic_search(query, logs, top_k=5):
-    if not logs or not query:
+def _corpus_metadata(corpus):
+    """Parallel per-field lists (one entry per corpus row) used to assemble semantic matches."""
+    meta = {field: [d.get(field, default) for d in corpus] for field, default in META_FIELDS.items()}
+    # trim once here rather than on every query
+    meta["Message"] = [(m or "")[:150] for m in meta["Message"]]
+    return meta
+
+
+def semantic_search(query, cache, top_k=5, rows=None):
+    """
+    Top-k semantic matches over the cached corpus (logs + insights).
+    `rows` optionally restricts the search to those corpus row indices.
+    """
+    corpus_size = len(cache["logs"]) + len(cache["insights"])
+    if not query or not corpus_size or rows == []:
         return []
 
-    corpus = [
-        f"{l.get('Message', '')} | App: {l.get('AppName', '')} | Level: {l.get('Level', '')}"
-        for l in logs
-    ]
+    corpus_emb = cache["corpus_emb"]
+    if corpus_emb is None:
+        corpus_emb = corpus_embeddings(cache["logs"] + cache["insights"])
+    if rows is not None:
+        corpus_emb = corpus_emb[torch.as_tensor(rows, device=corpus_emb.device)]
+
+    query_emb = _query_embedding(query)
+
+    # embeddings are already L2-normalized, so cosine similarity is a plain dot product
+    sims = (query_emb @ corpus_emb.T).squeeze(0)
+    k = min(top_k, corpus_emb.shape[0])
+    scores, indices = torch.topk(sims, k=k)
 
-    query_emb = encode_texts([query])
-    corpus_emb = encode_texts(corpus)
+    # one device->host copy for scores and indices together (fp32 holds indices exactly)
+    scores_l, idx_l = torch.stack((scores.float(), indices.float())).tolist()
 
-    sims = util.cos_sim(query_emb, corpus_emb)[0]
-    k = min(top_k, len(corpus))
-    top_results = torch.topk(sims, k=k)
+    meta = cache["meta"]
+    apps, levels, messages = meta["AppName"], meta["Level"], meta["Message"]
+    timestamps, severities = meta["Timestamp"], meta["Severity"]
 
     results = []
-    for score, idx in zip(top_results.values.cpu().tolist(), top_results.indices.cpu().tolist()):
-        log = logs[idx]
+    for score, idx in zip(scores_l, idx_l):
+        i = rows[int(idx)] if rows is not None else int(idx)
         results.append({
-            "AppName": log.get("AppName", "Unknown"),
-            "Level": log.get("Level", "N/A"),
-            "Message": log.get("Message", "")[:150],
-            "Timestamp": log.get("Timestamp", "N/A"),
-            "Severity": log.get("Severity", "N/A"),
-            "score": round(float(score), 3)
+            "AppName": apps[i],
+            "Level": levels[i],
+            "Message": messages[i],
+            "Timestamp": timestamps[i],
+            "Severity": severities[i],
+            "score": round(score, 3)
         })
     return results
 
 
+# ==============================================================
+#  Intent Detection
+# ==============================================================
+def detect_intents(q: str) -> set:
+    """All intents whose keywords appear in the (lowercased) query."""
+    return {intent for m in _INTENT_RE.finditer(q) for intent in _KEYWORD_INTENTS[m.group(1)]}
+
+
+# ==============================================================
+#  Timeline Aggregation
+# ==============================================================
+def _service_hourly_timelines(error_logs, services):
+    """Per-service hourly error counts, bucketed on the Cosmos `_ts` epoch seconds."""
+    timelines = {app: [] for app in services}
+    if not error_logs:
+        return timelines
+
+    app_to_id = {app: i for i, app in enumerate(services)}
+    n = len(error_logs)
+    app_idx = np.fromiter((app_to_id[l.get("AppName", "Unknown")] for l in error_logs), dtype=np.int64, count=n)
+    hours = np.fromiter((l.get("_ts", 0) for l in error_logs), dtype=np.int64, count=n) // 3600
+
+    # unique (app, hour) pairs come back sorted by app, then hour
+    pairs, pair_counts = np.unique(np.stack([app_idx, hours]), axis=1, return_counts=True)
+    for (a, h), c in zip(pairs.T.tolist(), pair_counts.tolist()):
+        hour_key = datetime.fromtimestamp(h * 3600, tz=timezone.utc).isoformat()
+        timelines[services[a]].append({"timestamp": hour_key, "error_count": c})
+    return timelines
+
+
+def _hourly_error_totals(insights):
+    """Sum insight error_count per hour, bucketed on the Cosmos `_ts` epoch seconds."""
+    n = len(insights)
+    hours = np.fromiter((i.get("_ts", 0) for i in insights), dtype=np.int64, count=n) // 3600
+    errors = np.fromiter((i.get("error_count") or 0 for i in insights), dtype=np.int64, count=n)
+
+    uniq, inverse = np.unique(hours, return_inverse=True)
+    totals = np.bincount(inverse, weights=errors, minlength=uniq.size)
+    return [
+        {"timestamp": datetime.fromtimestamp(h * 3600, tz=timezone.utc).isoformat(), "error_count": int(c)}
+        for h, c in zip(uniq.tolist(), totals.tolist())
+    ]
+
+
 # ==============================================================
 # 🔍 Intelligent Search Core
 # ==============================================================
+# fields that belong to one request; cached responses keep the slots but not the values
+PER_REQUEST_FIELDS = ("timestamp", "query")
+
+
+def response_body(result: dict) -> dict:
+    """Copy of a search response with the per-request fields blanked, for caching."""
+    return {k: (None if k in PER_REQUEST_FIELDS else v) for k, v in result.items()}
+
+
+def stamp_response(body: dict, query: str) -> dict:
+    """Fresh response from a cached body, carrying this request's query and timestamp."""
+    result = dict(body)
+    if "timestamp" in result:
+        result["timestamp"] = datetime.now(timezone.utc).isoformat()
+    if "query" in result:
+        result["query"] = query
+    return result
+
+
 def intelligent_search(query: str, top_k: int = 5, from_time: str = None, to_time: str = None):
     """Smart hybrid search for insights and errors."""
-    data = refresh_cache(force=True)
-    logs, insights = data["logs"], data["insights"]
+    global _resp_cache_token
+    data = refresh_cache()
     q = query.lower().strip()
+    key = (q, top_k)
+
+    # responses are only valid for the cache snapshot they were computed from
+    with _resp_cache_lock:
+        if data["last_refresh"] != _resp_cache_token:
+            _RESP_CACHE.clear()
+            _resp_cache_token = data["last_refresh"]
+        body = _RESP_CACHE.get(key)
+        if body is not None:
+            _RESP_CACHE.move_to_end(key)
+
+    if body is None:
+        body = response_body(_search(query, q, top_k, data))
+        with _resp_cache_lock:
+            if data["last_refresh"] == _resp_cache_token:
+                _RESP_CACHE[key] = body
+                if len(_RESP_CACHE) > RESP_CACHE_SIZE:
+                    _RESP_CACHE.popitem(last=False)
+
+    result = stamp_response(body, query)
+    if "type" in result:
+        save_history(result)
+    return result
+
+
+def _search(query: str, q: str, top_k: int, data: dict):
+    """Compute the search response for the lowercased query `q` against one cache snapshot."""
+    logs, insights = data["logs"], data["insights"]
+    intents = detect_intents(q)
 
     # ----------------------------------------------------------
     # A 🔶 Service-Level Insights
     # ----------------------------------------------------------
-    if "error" in q or "service" in q or "critical" in q:
+    if "service_level" in intents:
         error_logs = [l for l in logs if l.get("Level", "").lower() in ["error", "critical"]]
         counts = Counter(l.get("AppName", "Unknown") for l in error_logs)
         top_services = counts.most_common(5)
         latest = max(insights, key=lambda x: x.get("_ts", 0), default={})
 
-        timelines = defaultdict(lambda: defaultdict(int))
-        for l in error_logs:
-            app = l.get("AppName", "Unknown")
-            ts = datetime.fromisoformat(l.get("Timestamp").replace("Z", "+00:00"))
-            hour_key = ts.replace(minute=0, second=0, microsecond=0).isoformat()
-            timelines[app][hour_key] += 1
-
-        service_timelines = {
-            app: [{"timestamp": k, "error_count": v} for k, v in sorted(hour_map.items())]
-            for app, hour_map in timelines.items()
-        }
+        service_timelines = _service_hourly_timelines(error_logs, list(counts))
 
         result = {
             "type": "service_level",
@@ -207,33 +495,28 @@ def intelligent_search(query: str, top_k: int = 5, from_time: str = None, to_tim
                     "last_error_timestamp": max([l.get("Timestamp", "N/A") for l in svc_logs], default="N/A")
                 }
 
-        save_history(result)
         return result
 
     # ----------------------------------------------------------
     # B 🔷 System-Level Insights
     # ----------------------------------------------------------
-    elif "system" in q or "stable" in q or "health" in q or "trend" in q:
+    elif "system_health" in intents:
         if not insights:
             return {"message": "No insights available."}
 
         latest = max(insights, key=lambda x: x.get("_ts", 0))
         statuses = [i.get("status", "UNKNOWN") for i in insights]
-        critical_times = [
-            datetime.fromisoformat(i["timestamp"].replace("Z", ""))
-            for i in insights if i.get("status") == "CRITICAL"
-        ]
+        critical_times = np.array(
+            [i["timestamp"].replace("Z", "") for i in insights if i.get("status") == "CRITICAL"],
+            dtype="datetime64[us]"
+        )
 
         mtbf = None
-        if len(critical_times) > 1:
-            deltas = [(critical_times[i] - critical_times[i+1]).total_seconds()/3600 for i in range(len(critical_times)-1)]
-            mtbf = round(sum(deltas)/len(deltas), 2)
+        if critical_times.size > 1:
+            gaps_hrs = -np.diff(critical_times) / np.timedelta64(1, "h")
+            mtbf = round(float(gaps_hrs.mean()), 2)
 
-        timeline = {}
-        for i in insights:
-            ts = datetime.fromisoformat(i["timestamp"].replace("Z", "+00:00"))
-            hour = ts.replace(minute=0, second=0, microsecond=0).isoformat()
-            timeline[hour] = timeline.get(hour, 0) + i.get("error_count", 0)
+        timeline = _hourly_error_totals(insights)
 
         result = {
             "type": "system_health",
@@ -245,34 +528,32 @@ def intelligent_search(query: str, top_k: int = 5, from_time: str = None, to_tim
             "mean_time_between_failures_hrs": mtbf or "N/A",
             "trend": "Degrading" if statuses[:3].count("CRITICAL") > 1 else "Stable",
             "records_analyzed": len(insights),
-            "timeline": [{"timestamp": k, "error_count": v} for k, v in sorted(timeline.items())]
+            "timeline": timeline
         }
 
-        save_history(result)
         return result
 
     # ----------------------------------------------------------
     # C 🟪 Semantic FALLBACK  (IMPROVED 🔥)
     # ----------------------------------------------------------
     else:
-        combined = logs + insights
+        rows = None  # whole corpus (logs + insights)
 
         # 🟩 🟩 🟩 IMPROVEMENT: Detect failure queries and prioritize ERROR logs
-        FAILURE_KEYWORDS = ["fail", "failed", "failure", "error", "critical", "issue", "crash"]
-
-        if any(word in q for word in FAILURE_KEYWORDS):
+        if "failure" in intents:
             print("⚠ Failure intent detected → prioritizing ERROR logs")
 
-            failure_logs = [
-                l for l in logs
+            # logs come first in the corpus, so a log's index is its corpus row
+            failure_rows = [
+                i for i, l in enumerate(logs)
                 if l.get("Level", "").lower() in ["error", "critical"]
             ]
 
-            if failure_logs:
-                combined = failure_logs
+            if failure_rows:
+                rows = failure_rows
 
         # Run semantic vector search
-        matches = semantic_search(query, combined, top_k=top_k)
+        matches = semantic_search(query, data, top_k=top_k, rows=rows)
 
         result = {
             "type": "semantic",
@@ -282,7 +563,6 @@ def intelligent_search(query: str, top_k: int = 5, from_time: str = None, to_tim
             "semantic_matches": matches
         }
 
-        save_history(result)
         return result
 
 
@@ -290,4 +570,4 @@ def intelligent_search(query: str, top_k: int = 5, from_time: str = None, to_tim
 #  Exportable Utilities
 # ==============================================================
 def search_history():
-    return load_history()
+    return _HISTORY if _HISTORY is not None else load_history()
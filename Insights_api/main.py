@@ -2,11 +2,17 @@ from fastapi import FastAPI, Query, HTTPException
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 from .cosmos_client import logs_container, insights_container
-from .intelligent_search import intelligent_search, search_history, refresh_cache
+from .intelligent_search import (
+    intelligent_search, search_history, refresh_cache, save_history, embed, detect_intents,
+    response_body, stamp_response,
+)
 from fastapi import Query
+from starlette.concurrency import run_in_threadpool
 
 import os
 import logging
+import numpy as np
+from functools import lru_cache
 
 app = FastAPI(
     title="Intelligent Log Insights API",
@@ -14,21 +20,80 @@ app = FastAPI(
     version=os.getenv("APP_VERSION", "1.0.0")
 )
 
+# Timeline buckets are reported in IST
+IST = timezone(timedelta(hours=5, minutes=30))
+IST_OFFSET_SEC = int(IST.utcoffset(None).total_seconds())
+
+# Semantic cache for intelligent searches: near-duplicate phrasings of a semantic query reuse
+# its result. Exact repeats are already memoized inside intelligent_search.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = 256
+# intents answered from keyword routing rather than embeddings; never served semantically
+STRUCTURED_INTENTS = {"service_level", "system_health"}
+# (embedding, scope, response body without query/timestamp), oldest first;
+# valid only for the search snapshot in _semantic_cache_token
+_SEMANTIC_CACHE = []
+_semantic_cache_token = None
+
+# Hard caps on rows a single request can pull back
+DEFAULT_LOGS_LIMIT = 500
+MAX_LOGS_LIMIT = 5000
+MAX_HEALTH_RECORDS = 1000
+
+# Shared query options: skip per-query metrics collection on every request
+QUERY_OPTIONS = {"enable_cross_partition_query": True, "populate_query_metrics": False}
+
+
+#  SQL builders: the text depends only on which filters are present, and user
+#  values travel as parameters, so Cosmos sees a handful of stable query shapes
+#  it can reuse plans for (and nothing user-supplied is spliced into the SQL).
+@lru_cache(maxsize=None)
+def _logs_query(has_level: bool, has_service: bool) -> str:
+    filters = []
+    if has_level:
+        filters.append("LOWER(c.Level) = LOWER(@level)")
+    if has_service:
+        filters.append("LOWER(c.AppName) = LOWER(@service)")
+    where_clause = " AND ".join(filters) if filters else "1=1"
+    return f"SELECT TOP @limit * FROM c WHERE {where_clause} ORDER BY c._ts DESC"
+
+
+@lru_cache(maxsize=None)
+def _error_timeline_query(has_start: bool) -> str:
+    # shift _ts into IST before flooring so buckets start on IST boundaries
+    bucket_expr = "FLOOR((c._ts + @offset) / @bucket)"
+    filters = "LOWER(c.Level) = @level"
+    if has_start:
+        filters += " AND c.Timestamp >= @start"
+    return f"SELECT {bucket_expr} AS b, COUNT(1) AS n FROM c WHERE {filters} GROUP BY {bucket_expr}"
+
+
+@lru_cache(maxsize=None)
+def _health_query(has_since: bool) -> str:
+    if has_since:
+        return "SELECT TOP @max_records * FROM c WHERE c.timestamp >= @since ORDER BY c.timestamp DESC"
+    return "SELECT TOP @last_n * FROM c ORDER BY c.timestamp DESC"
+
+
 # 1️ Fetch filtered logs
 @app.get("/logs")
-def get_logs(level: Optional[str] = Query(None), service: Optional[str] = Query(None)):
-    filters = []
+def get_logs(
+    level: Optional[str] = Query(None),
+    service: Optional[str] = Query(None),
+    limit: int = Query(DEFAULT_LOGS_LIMIT, ge=1, le=MAX_LOGS_LIMIT, description="Maximum number of logs to return (newest first)")
+):
+    query = _logs_query(bool(level), bool(service))
+    parameters = [{"name": "@limit", "value": limit}]
     if level:
-        filters.append(f"LOWER(c.Level) = LOWER('{level}')")
+        parameters.append({"name": "@level", "value": level})
     if service:
-        filters.append(f"LOWER(c.AppName) = LOWER('{service}')")
+        parameters.append({"name": "@service", "value": service})
 
-    where_clause = " AND ".join(filters) if filters else "1=1"
-    query = f"SELECT * FROM c WHERE {where_clause} ORDER BY c._ts DESC"
-
-    results = list(logs_container.query_items(query=query, enable_cross_partition_query=True))
+    results = list(logs_container.query_items(
+        query=query, parameters=parameters, max_item_count=limit, **QUERY_OPTIONS
+    ))
     return {
-        "filters": {"level": level, "service": service},
+        "filters": {"level": level, "service": service, "limit": limit},
         "count": len(results),
         "data": results
     }
@@ -40,19 +105,30 @@ def get_logs(level: Optional[str] = Query(None), service: Optional[str] = Query(
 @app.get("/analytics/errors")
 def get_error_analytics():
     """
-    Fallback: compute error counts manually without Cosmos GROUP BY.
+    Error counts per service, aggregated server-side with Cosmos GROUP BY
+    (only one row per service crosses the wire).
     """
     try:
-        # 1️ Get all error-level logs
-        query = "SELECT c.AppName, c.Level FROM c WHERE LOWER(c.Level) = 'error'"
-        items = list(logs_container.query_items(query=query, enable_cross_partition_query=True))
+        # 1️ Count error-level logs per AppName in Cosmos
+        query = (
+            "SELECT c.AppName AS service, COUNT(1) AS error_count FROM c "
+            "WHERE LOWER(c.Level) = @level GROUP BY c.AppName"
+        )
+        groups = logs_container.query_items(
+            query=query,
+            parameters=[{"name": "@level", "value": "error"}],
+            **QUERY_OPTIONS
+        )
 
-        if not items:
+        #  Consume pages as they arrive; docs without AppName come back as a group with no "service" field
+        from collections import Counter
+        app_counter = Counter()
+        for g in groups:
+            app_counter[g.get("service", "Unknown")] += g.get("error_count", 0)
+
+        if not app_counter:
             return {"message": "No error logs found.", "top_error_services": []}
 
-        #  Group by AppName manually
-        from collections import Counter
-        app_counter = Counter(i.get("AppName", "Unknown") for i in items)
         total_errors = sum(app_counter.values()) or 1
 
         #  Format the response
@@ -82,46 +158,38 @@ def get_error_analytics():
 @app.get("/analytics/errors/timeline")
 def get_error_timeline(
     start_time: Optional[str] = Query(None, description="Start ISO timestamp"),
-    interval_minutes: int = Query(5, description="Time bucket in minutes (default=5)")
+    interval_minutes: int = Query(5, ge=1, description="Time bucket in minutes (default=5)")
 ):
     """
     Intelligent error timeline grouping:
-    - Converts timestamps to IST
+    - Buckets are counted in Cosmos (GROUP BY on the _ts epoch), aligned to IST
     - Recent buckets shown first
     """
 
-    query = "SELECT c.Timestamp, c._ts FROM c WHERE LOWER(c.Level) = 'error'"
+    bucket_sec = interval_minutes * 60
 
+    parameters = [
+        {"name": "@level", "value": "error"},
+        {"name": "@offset", "value": IST_OFFSET_SEC},
+        {"name": "@bucket", "value": bucket_sec},
+    ]
     if start_time:
-        query += f" AND c.Timestamp >= '{start_time}'"
-
-    results = list(logs_container.query_items(query=query, enable_cross_partition_query=True))
-    if not results:
-        return {"message": "No errors found in this time range."}
-
-    from collections import Counter
-    from datetime import timezone, timedelta
-    import dateutil.parser
+        parameters.append({"name": "@start", "value": start_time})
 
-    IST = timezone(timedelta(hours=5, minutes=30))
-    buckets = Counter()
+    query = _error_timeline_query(bool(start_time))
+    rows = logs_container.query_items(query=query, parameters=parameters, **QUERY_OPTIONS)
 
-    for r in results:
-        ts_value = r.get("Timestamp")
-        if ts_value:
-            ts = dateutil.parser.parse(ts_value).astimezone(IST)
-        else:
-            ts = datetime.fromtimestamp(r["_ts"], tz=IST)   # fallback
-
-        bucket_key = ts.replace(
-            second=0, microsecond=0,
-            minute=(ts.minute // interval_minutes) * interval_minutes
-        )
-        buckets[str(bucket_key)] += 1
+    # sorted() drains the result pages directly; only one row per bucket is held
+    buckets = sorted(((int(r["b"]), r["n"]) for r in rows), reverse=True)   # LATEST FIRST
+    if not buckets:
+        return {"message": "No errors found in this time range."}
 
     timeline = [
-        {"timestamp": k, "error_count": v}
-        for k, v in sorted(buckets.items(), reverse=True)   # LATEST FIRST
+        {
+            "timestamp": str(datetime.fromtimestamp(b * bucket_sec - IST_OFFSET_SEC, tz=IST)),
+            "error_count": n
+        }
+        for b, n in buckets
     ]
 
     return {
@@ -135,8 +203,19 @@ def get_error_timeline(
 
 
 
+def _semantic_cache_lookup(query_emb, scope):
+    """Cached result of the most similar query with the same scope, if it clears the threshold."""
+    candidates = [e for e in _SEMANTIC_CACHE if e[1] == scope]
+    if not candidates:
+        return None
+    # embeddings are L2-normalized, so one matmul gives every cosine similarity
+    sims = np.stack([e[0] for e in candidates]) @ query_emb
+    best = int(np.argmax(sims))
+    return candidates[best][2] if sims[best] >= SEMANTIC_CACHE_THRESHOLD else None
+
+
 @app.post("/analytics/intelligent_search")
-def perform_intelligent_search(
+async def perform_intelligent_search(
     query: str,
     top_k: int = 5,
     from_time: str = None,
@@ -147,8 +226,34 @@ def perform_intelligent_search(
     Uses SentenceTransformer-based semantic analysis
     and rule-based reasoning for insights.
     """
+    global _semantic_cache_token
     try:
-        result = intelligent_search(query=query, top_k=top_k, from_time=from_time, to_time=to_time)
+        q = query.lower().strip()
+        intents = detect_intents(q)
+        result = query_emb = scope = snapshot = None
+        if not intents & STRUCTURED_INTENTS:
+            # cached answers are only valid for the search snapshot they were computed from
+            snapshot = (await run_in_threadpool(refresh_cache))["last_refresh"]
+            if snapshot != _semantic_cache_token:
+                _SEMANTIC_CACHE.clear()
+                _semantic_cache_token = snapshot
+            # the failure intent narrows the rows searched, so it is part of the scope
+            scope = (top_k, from_time, to_time, frozenset(intents))
+            query_emb = await run_in_threadpool(embed, query)
+            cached = _semantic_cache_lookup(query_emb, scope)
+            if cached is not None:
+                # the cached answer came from another phrasing: report this query and time
+                result = stamp_response(cached, query)
+
+        if result is None:
+            result = await run_in_threadpool(intelligent_search, query, top_k, from_time, to_time)
+            if query_emb is not None and snapshot == _semantic_cache_token:
+                del _SEMANTIC_CACHE[:-(SEMANTIC_CACHE_SIZE - 1)]
+                _SEMANTIC_CACHE.append((query_emb, scope, response_body(result)))
+        elif "type" in result:
+            # cache hits are still recorded, as intelligent_search does for its own hits
+            await run_in_threadpool(save_history, result)
+
         return {
             "status": "success",
             "query": query,
@@ -193,12 +298,20 @@ def get_system_health(
                     raise HTTPException(status_code=400, detail="Invalid 'since' format. Use ISO8601 or like 2h / 1d.")
 
         #  Build query for TriggerInsights
+        query = _health_query(bool(time_filter))
         if time_filter:
-            query = f"SELECT * FROM c WHERE c.timestamp >= '{time_filter}' ORDER BY c.timestamp DESC"
+            parameters = [
+                {"name": "@since", "value": time_filter},
+                {"name": "@max_records", "value": MAX_HEALTH_RECORDS},
+            ]
         else:
-            query = f"SELECT TOP {last_n} * FROM c ORDER BY c.timestamp DESC"
+            parameters = [{"name": "@last_n", "value": last_n}]
 
-        items = list(insights_container.query_items(query=query, enable_cross_partition_query=True))
+        # both shapes are TOP-capped; size pages to the cap to avoid extra round-trips
+        page_size = MAX_HEALTH_RECORDS if time_filter else last_n
+        items = list(insights_container.query_items(
+            query=query, parameters=parameters, max_item_count=page_size, **QUERY_OPTIONS
+        ))
 
         if not items:
             return {"status": "UNKNOWN", "message": "No health data found in TriggerInsights"}
@@ -206,22 +319,21 @@ def get_system_health(
         #  Compute latest health and historical trend
         latest = items[0]
         statuses = [doc.get("status", "UNKNOWN") for doc in items]
-        critical_times = [
-            datetime.fromisoformat(doc["timestamp"].replace("Z", ""))
-            for doc in items if doc.get("status") == "CRITICAL"
-        ]
+        is_critical = np.array(statuses) == "CRITICAL"
+        # newest first, parsed in one go (microsecond unit keeps fractional-second timestamps valid)
+        critical_times = np.array(
+            [doc["timestamp"].replace("Z", "") for doc in items if doc.get("status") == "CRITICAL"],
+            dtype="datetime64[us]"
+        )
 
         #  Compute Mean Time Between Failures (MTBF)
         mtbf_hours = None
-        if len(critical_times) > 1:
-            deltas = [
-                (critical_times[i] - critical_times[i + 1]).total_seconds() / 3600
-                for i in range(len(critical_times) - 1)
-            ]
-            mtbf_hours = round(sum(deltas) / len(deltas), 2)
+        if critical_times.size > 1:
+            gaps_hrs = -np.diff(critical_times) / np.timedelta64(1, "h")
+            mtbf_hours = round(float(gaps_hrs.mean()), 2)
 
         #  Identify trend (based on most recent 3 statuses)
-        trend = "Improving" if statuses[:3].count("CRITICAL") == 0 else "Degrading"
+        trend = "Degrading" if is_critical[:3].any() else "Improving"
 
         #  Construct output
         health_summary = {
@@ -1,4 +1,6 @@
-import requests, json, hmac, hashlib, base64, os
+import hmac, hashlib, base64, os, json
+import httpx
+import orjson
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
@@ -7,16 +9,34 @@ WORKSPACE_ID = os.getenv("LA_WORKSPACE_ID")
 SHARED_KEY = os.getenv("LA_SHARED_KEY")
 LOG_TYPE = "CustomAppLogs"
 
+# The key never changes: decode it once and copy a keyed HMAC per signature
+_HMAC_TEMPLATE = hmac.new(base64.b64decode(SHARED_KEY), digestmod=hashlib.sha256) if SHARED_KEY else None
+
+# One pooled HTTP/2 client for every post: keep-alive instead of a TLS handshake per log
+_client = httpx.AsyncClient(http2=True, timeout=10.0, limits=httpx.Limits(max_keepalive_connections=20))
+
+def to_json_bytes(obj) -> bytes:
+    """orjson, falling back to stdlib json for values orjson rejects (e.g. integers beyond 64 bits)."""
+    try:
+        return orjson.dumps(obj)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj).encode("utf-8")
+
 def build_signature(date, content_length):
     x_headers = 'x-ms-date:' + date
     string_to_hash = f"POST\n{content_length}\napplication/json\n{x_headers}\n/api/logs"
     bytes_to_hash = bytes(string_to_hash, encoding='utf-8')
-    decoded_key = base64.b64decode(SHARED_KEY)
-    encoded_hash = base64.b64encode(hmac.new(decoded_key, bytes_to_hash, hashlib.sha256).digest()).decode()
+    if _HMAC_TEMPLATE is None:
+        raise ValueError("LA_SHARED_KEY is not set.")
+    h = _HMAC_TEMPLATE.copy()
+    h.update(bytes_to_hash)
+    encoded_hash = base64.b64encode(h.digest()).decode()
     return f"SharedKey {WORKSPACE_ID}:{encoded_hash}"
 
-def send_log(log_data):
-    body = json.dumps(log_data)
+async def send_log(log_data):
+    # log_data may be one log, a list, or an already-serialized JSON body;
+    # the Data Collector API takes a JSON array as one request
+    body = log_data if isinstance(log_data, bytes) else to_json_bytes(log_data)  # len(body) is the signed byte length
     rfc1123date = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
     sig = build_signature(rfc1123date, len(body))
     uri = f"https://{WORKSPACE_ID}.ods.opinsights.azure.com/api/logs?api-version=2016-04-01"
@@ -26,5 +46,9 @@ def send_log(log_data):
         'Log-Type': LOG_TYPE,
         'x-ms-date': rfc1123date
     }
-    r = requests.post(uri, data=body, headers=headers)
+    r = await _client.post(uri, content=body, headers=headers)
     print(f"Sent → {r.status_code}")
+    r.raise_for_status()  # surface rejected posts so the caller can retry them
+
+async def close():
+    await _client.aclose()
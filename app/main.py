@@ -1,20 +1,106 @@
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request
 from dotenv import load_dotenv
-from azure.servicebus import ServiceBusClient, ServiceBusMessage
-from app.la_post import send_log
+from azure.servicebus import ServiceBusMessage
+from azure.servicebus.aio import ServiceBusClient
+from app.la_post import send_log, to_json_bytes, close as close_la_client
 import os
-import json
-import time
+import asyncio
 import logging
+import msgspec
 
 # ---- Setup ----
 load_dotenv()
 
 SERVICEBUS_CONNECTION = os.getenv("SERVICE_BUS_CONNECTION")
 SERVICEBUS_QUEUE = os.getenv("SERVICE_BUS_QUEUE")
+# send MessagePack instead of JSON; enable once the queue consumer is deployed with msgpack support
+SERVICEBUS_MSGPACK = os.getenv("SERVICE_BUS_MSGPACK", "false").lower() == "true"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+SEND_ATTEMPTS = 3
+# Log Analytics posts are coalesced: one signed request per 100 logs or per 500 ms
+LA_BATCH_SIZE = 100
+LA_FLUSH_INTERVAL = 0.5
+# how long shutdown waits for queued logs to reach Log Analytics before dropping them
+LA_SHUTDOWN_TIMEOUT = float(os.getenv("LA_SHUTDOWN_TIMEOUT", "10"))
+# cap on outbound sends in flight across all requests, so a burst can't open unbounded I/O
+_send_slots = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_SENDS", "32")))
 
 app = FastAPI()
-sb_client = ServiceBusClient.from_connection_string(SERVICEBUS_CONNECTION)
+
+
+def to_sb_message(log) -> ServiceBusMessage:
+    if SERVICEBUS_MSGPACK:
+        try:
+            return ServiceBusMessage(msgspec.msgpack.encode(log), content_type=MSGPACK_CONTENT_TYPE)
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            pass  # e.g. integers beyond 64 bits; the consumer reads JSON too
+    return ServiceBusMessage(to_json_bytes(log))
+
+
+async def send_with_retry(target: str, send, count: int):
+    """Await send() under the shared concurrency cap, retrying with exponential backoff."""
+    for attempt in range(SEND_ATTEMPTS):
+        try:
+            async with _send_slots:
+                await send()
+            logging.info(f" Sent {count} logs to {target} (Attempt {attempt+1})")
+            return
+        except Exception as e:
+            logging.warning(f" Retry {attempt+1}/{SEND_ATTEMPTS} failed to send to {target}: {e}")
+            if attempt + 1 < SEND_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt * 0.5)
+    logging.error(f" {target} send failed after {SEND_ATTEMPTS} attempts")
+
+
+async def _la_worker(queue: asyncio.Queue):
+    """Drain queued (already serialized) logs into Log Analytics in batches of up to LA_BATCH_SIZE."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + LA_FLUSH_INTERVAL
+        while len(batch) < LA_BATCH_SIZE:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        body = b"[" + b",".join(batch) + b"]"
+        try:
+            await send_with_retry("Log Analytics", lambda: send_log(body), len(batch))
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+@app.on_event("startup")
+async def startup():
+    # One async client + sender for the life of the process: the AMQP link is set up
+    # once here instead of on every request (and never blocks the event loop)
+    app.state.sb_client = ServiceBusClient.from_connection_string(SERVICEBUS_CONNECTION)
+    app.state.sender = app.state.sb_client.get_queue_sender(queue_name=SERVICEBUS_QUEUE)
+    await app.state.sender.__aenter__()
+    app.state.la_queue = asyncio.Queue()
+    app.state.la_worker = asyncio.create_task(_la_worker(app.state.la_queue))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # flush logs still waiting for Log Analytics before the HTTP client goes away,
+    # but don't let an unreachable workspace (or a dead worker) hold up shutdown
+    try:
+        await asyncio.wait_for(app.state.la_queue.join(), LA_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.error(f" Log Analytics flush timed out; dropping {app.state.la_queue.qsize()} queued logs (plus any batch in flight)")
+    app.state.la_worker.cancel()
+    await app.state.sender.close()
+    await app.state.sb_client.close()
+    await close_la_client()
+
 
 @app.get("/")
 def home():
@@ -22,30 +108,28 @@ def home():
 
 
 @app.post("/log")
-async def ingest_logs(req: Request, bg: BackgroundTasks):
-    """Receive logs, send them to Log Analytics and Service Bus."""
+async def ingest_logs(req: Request):
+    """Receive logs, send them to Service Bus and queue them for Log Analytics."""
     logs_batch = await req.json()
     if not isinstance(logs_batch, list):
         logs_batch = [logs_batch]
 
-    # --- Send batch to Service Bus ---
-    try:
-        with sb_client.get_queue_sender(queue_name=SERVICEBUS_QUEUE) as sender:
-            messages = [ServiceBusMessage(json.dumps(log)) for log in logs_batch]
-
-            for attempt in range(3):
-                try:
-                    sender.send_messages(messages)
-                    logging.info(f" Sent {len(logs_batch)} logs to Service Bus (Attempt {attempt+1})")
-                    break
-                except Exception as e:
-                    logging.warning(f" Retry {attempt+1}/3 failed to send to Service Bus: {e}")
-                    time.sleep(1.5)
-    except Exception as e:
-        logging.error(f" Service Bus send failed: {e}")
-
-    # --- Send to Log Analytics asynchronously ---
+    # Serialize each log up front: one unserializable log is dropped on its own instead of
+    # failing a shared Log Analytics batch, and serialization errors are never retried
+    messages = []
     for log in logs_batch:
-        bg.add_task(send_log, log)
+        try:
+            la_body = to_json_bytes(log)
+            sb_message = to_sb_message(log)
+        except (TypeError, ValueError) as e:
+            logging.error(f" Dropping unserializable log: {e}")
+            continue
+        # --- Log Analytics: handed to the batching worker ---
+        app.state.la_queue.put_nowait(la_body)
+        messages.append(sb_message)
+
+    # --- Send batch to Service Bus ---
+    if messages:
+        await send_with_retry("Service Bus", lambda: app.state.sender.send_messages(messages), len(messages))
 
     return {"status": f"{len(logs_batch)} logs queued"}
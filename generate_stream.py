@@ -1,6 +1,6 @@
 import requests
+import orjson
 import random
-import uuid
 import time
 from datetime import datetime, timedelta, timezone
 from requests.adapters import HTTPAdapter
@@ -13,133 +13,153 @@ session = requests.Session()
 retries = Retry(total=3, backoff_factor=0.5)
 session.mount("http://", HTTPAdapter(max_retries=retries))
 
-
-def generate_log_entry():
-    """Generate one realistic healthcare insurance log entry with Azure-style structure."""
-    user = random.choice([
-        "patient_ravi", "patient_meena", "doctor_arun",
-        "ins_officer_neha", "admin_kiran", "api_gateway"
-    ])
-    service = random.choice([
-        "ClaimProcessingService", "FileUploadService",
-        "ECGAnalysisService", "PatientPortalAPI",
-        "FraudDetectionService", "NotificationService"
-    ])
-    file = random.choice([
-        "ECG_Report.pdf", "Insurance_Form.docx", "Lab_Results.csv",
-        "Claim_Documents.zip", "KYC_Verification.json"
-    ])
-    req_id = f"req_{uuid.uuid4().hex[:8]}"
+# --- Generator vocabularies (built once, not on every log) ---
+USERS = (
+    "patient_ravi", "patient_meena", "doctor_arun",
+    "ins_officer_neha", "admin_kiran", "api_gateway"
+)
+SERVICES = (
+    "ClaimProcessingService", "FileUploadService",
+    "ECGAnalysisService", "PatientPortalAPI",
+    "FraudDetectionService", "NotificationService"
+)
+FILES = (
+    "ECG_Report.pdf", "Insurance_Form.docx", "Lab_Results.csv",
+    "Claim_Documents.zip", "KYC_Verification.json"
+)
+# Log categories (like Azure Monitor severity levels) with cumulative weights 60/10/15/5/5/5
+LOG_CATEGORIES = ("Information", "Warning", "Error", "Critical", "Security", "Performance")
+LOG_CATEGORY_CUM_WEIGHTS = (60, 70, 85, 90, 95, 100)
+OPERATIONS = (
+    "claim_submission", "file_upload", "login",
+    "document_validation", "report_analysis",
+    "payment_processing", "data_sync", "inference"
+)
+
+
+# Map operations to realistic success codes
+SUCCESS_CODE_BY_OP = {
+    "file_upload": (201, "Created"),
+    "claim_submission": (202, "Accepted"),
+    "login": (200, "OK"),
+    "document_validation": (200, "Validated"),
+    "report_analysis": (200, "Analyzed"),
+    "payment_processing": (200, "Payment Processed"),
+    "data_sync": (204, "No Content"),
+    "inference": (200, "Inference Completed")
+}
+ERROR_CASES = (
+    ("Invalid insurance document format", 422),
+    ("Claim API unavailable", 503),
+    ("ECG report timeout", 408),
+    ("Unauthorized data access", 401),
+    ("Duplicate claim submission", 409)
+)
+SECURITY_CASES = (
+    ("Invalid credentials", 401),
+    ("Account locked after repeated failures", 403),
+    ("Too many requests from device", 429)
+)
+
+
+# --- Per-category builders: each returns (status_code, status_detail, message, context_detail) ---
+def _information(service, operation, claim_id, patient_id, file, req_id, user):
+    status_code, status_detail = SUCCESS_CODE_BY_OP.get(operation, (200, "OK"))
+    message = (
+        f"{service}: Successfully completed {operation} for patient {patient_id}, "
+        f"claim {claim_id}. File {file} processed without issues."
+    )
+    return status_code, status_detail, message, {}
+
+
+def _warning(service, operation, claim_id, patient_id, file, req_id, user):
+    latency = random.randint(1200, 3000)
+    message = (
+        f"{service}: Degraded performance - {operation} experienced high latency "
+        f"({latency}ms) for claim {claim_id}. Operation returned partial results."
+    )
+    return 206, "Partial", message, {"latency_ms": latency, "threshold_ms": 1000}
+
+
+def _error(service, operation, claim_id, patient_id, file, req_id, user):
+    status_detail, status_code = random.choice(ERROR_CASES)
+    message = (
+        f"{service}: Error during {operation} for claim {claim_id}. "
+        f"Reason: {status_detail}. RequestId: {req_id}."
+    )
+    return status_code, status_detail, message, {}
+
+
+def _critical(service, operation, claim_id, patient_id, file, req_id, user):
+    message = (
+        f"{service}: CRITICAL — persistent database write failure while processing "
+        f"claim {claim_id}. Risk of data loss. RequestId: {req_id}."
+    )
+    return 500, "Internal Server Error", message, {"escalation": True, "impact": "data_loss"}
+
+
+def _security(service, operation, claim_id, patient_id, file, req_id, user):
+    reason, code = random.choice(SECURITY_CASES)
+    device = f"DEV-{random.randint(1000,9999)}"
+    attempts = random.randint(3, 12)
+    message = (
+        f"{service}: Security alert — {reason} (attempts={attempts}) for user {user} "
+        f"from device {device}."
+    )
+    return code, reason, message, {"failed_attempts": attempts, "device_id": device}
+
+
+def _performance(service, operation, claim_id, patient_id, file, req_id, user):
+    cpu = random.randint(40, 95)
+    latency = random.randint(200, 2500)
+    message = (
+        f"{service}: Performance metrics captured for {operation} — latency "
+        f"{latency}ms, cpu {cpu}%."
+    )
+    return 200, "Metrics", message, {"cpu_percent": cpu, "latency_ms": latency}
+
+
+# one dict lookup instead of an if/elif chain of string comparisons
+CATEGORY_BUILDERS = {
+    "Information": _information,
+    "Warning": _warning,
+    "Error": _error,
+    "Critical": _critical,
+    "Security": _security,
+    "Performance": _performance,
+}
+
+
+def generate_log_entry(ts: str = None):
+    """
+    Generate one realistic healthcare insurance log entry with Azure-style structure.
+    ts: TimeGenerated to stamp on the entry (pass one per batch); defaults to now.
+    """
+    user = random.choice(USERS)
+    service = random.choice(SERVICES)
+    file = random.choice(FILES)
+    # 32 random bits is plenty for a request tag; no need for a urandom-backed uuid4
+    req_id = f"req_{random.getrandbits(32):08x}"
     claim_id = f"C{random.randint(10000,99999)}"
     patient_id = f"P{random.randint(1000,9999)}"
 
     # Select log category (like Azure Monitor severity levels)
-    log_category = random.choices(
-        ["Information", "Warning", "Error", "Critical", "Security", "Performance"],
-        weights=[60, 10, 15, 5, 5, 5],
-        k=1
-    )[0]
-
-    operation = random.choice([
-        "claim_submission", "file_upload", "login",
-        "document_validation", "report_analysis",
-        "payment_processing", "data_sync", "inference"
-    ])
-
-    # Defaults
-    status_code = 200
-    status_detail = "OK"
-    message = ""
-    context_detail = {}
-
-    # Map operations to realistic success codes
-    success_code_by_op = {
-        "file_upload": (201, "Created"),
-        "claim_submission": (202, "Accepted"),
-        "login": (200, "OK"),
-        "document_validation": (200, "Validated"),
-        "report_analysis": (200, "Analyzed"),
-        "payment_processing": (200, "Payment Processed"),
-        "data_sync": (204, "No Content"),
-        "inference": (200, "Inference Completed")
-    }
+    log_category = random.choices(LOG_CATEGORIES, cum_weights=LOG_CATEGORY_CUM_WEIGHTS, k=1)[0]
+
+    operation = random.choice(OPERATIONS)
 
     # -------------------------
     # Realistic Log Generation
     # -------------------------
-    if log_category == "Information":
-        status_code, status_detail = success_code_by_op.get(operation, (200, "OK"))
-        message = (
-            f"{service}: Successfully completed {operation} for patient {patient_id}, "
-            f"claim {claim_id}. File {file} processed without issues."
-        )
-
-    elif log_category == "Warning":
-        status_code = 206
-        status_detail = "Partial"
-        latency = random.randint(1200, 3000)
-        message = (
-            f"{service}: Degraded performance - {operation} experienced high latency "
-            f"({latency}ms) for claim {claim_id}. Operation returned partial results."
-        )
-        context_detail = {"latency_ms": latency, "threshold_ms": 1000}
-
-    elif log_category == "Error":
-        err_case = random.choice([
-            ("Invalid insurance document format", 422),
-            ("Claim API unavailable", 503),
-            ("ECG report timeout", 408),
-            ("Unauthorized data access", 401),
-            ("Duplicate claim submission", 409)
-        ])
-        status_detail = err_case[0]
-        status_code = err_case[1]
-        message = (
-            f"{service}: Error during {operation} for claim {claim_id}. "
-            f"Reason: {status_detail}. RequestId: {req_id}."
-        )
-
-    elif log_category == "Critical":
-        status_code = 500
-        status_detail = "Internal Server Error"
-        message = (
-            f"{service}: CRITICAL — persistent database write failure while processing "
-            f"claim {claim_id}. Risk of data loss. RequestId: {req_id}."
-        )
-        context_detail = {"escalation": True, "impact": "data_loss"}
-
-    elif log_category == "Security":
-        reason, code = random.choice([
-            ("Invalid credentials", 401),
-            ("Account locked after repeated failures", 403),
-            ("Too many requests from device", 429)
-        ])
-        status_code = code
-        status_detail = reason
-        device = f"DEV-{random.randint(1000,9999)}"
-        attempts = random.randint(3, 12)
-        message = (
-            f"{service}: Security alert — {reason} (attempts={attempts}) for user {user} "
-            f"from device {device}."
-        )
-        context_detail = {"failed_attempts": attempts, "device_id": device}
-
-    elif log_category == "Performance":
-        cpu = random.randint(40, 95)
-        latency = random.randint(200, 2500)
-        status_code = 200
-        status_detail = "Metrics"
-        message = (
-            f"{service}: Performance metrics captured for {operation} — latency "
-            f"{latency}ms, cpu {cpu}%."
-        )
-        context_detail = {"cpu_percent": cpu, "latency_ms": latency}
+    status_code, status_detail, message, context_detail = CATEGORY_BUILDERS[log_category](
+        service, operation, claim_id, patient_id, file, req_id, user
+    )
 
     # -------------------------
     # Final structured log (Azure-style)
     # -------------------------
     return {
-        "TimeGenerated": datetime.now(timezone.utc).isoformat(),
+        "TimeGenerated": ts or datetime.now(timezone.utc).isoformat(),
         "Level": log_category,
         "Message": message,
         "UserId": user,
@@ -164,9 +184,14 @@ def stream_logs(duration_seconds=60):
     batch_count = 0
 
     while datetime.now(timezone.utc) < end_time:
-        batch = [generate_log_entry() for _ in range(random.randint(3, 6))]
+        # a batch is emitted all at once, so stamp it with a single clock read
+        ts = datetime.now(timezone.utc).isoformat()
+        batch = [generate_log_entry(ts) for _ in range(random.randint(3, 6))]
         try:
-            response = session.post(FASTAPI_URL, json=batch, timeout=15)
+            response = session.post(
+                FASTAPI_URL, data=orjson.dumps(batch),
+                headers={"Content-Type": "application/json"}, timeout=15
+            )
             if response.status_code == 200:
                 total_sent += len(batch)
                 batch_count += 1